@@ -2,33 +2,66 @@
 # TikTok Kit v2.2 - Enhanced CLI with Real TikTok API Integration
 # Updated for 2025 API changes: OAuth v2 with PKCE, Research v2, Shop v2
 # Features: Automated OAuth with local server, Real Ads Promotion, Advanced Data Analysis (Keywords, FYP Hours, Hashtags with ML and Visualizations), Enterprise Analytics, Affiliate Booster
-# Compatible with Termux. Install: pip install requests cryptography pyjwt pandas numpy scikit-learn python-dotenv tenacity matplotlib
+# Compatible with Termux. Install: pip install requests cryptography pandas numpy scikit-learn python-dotenv tenacity matplotlib
+# Optional: pip install orjson for faster encrypted data save/load
 # Enhanced: Local OAuth callback server, retries on API calls, .env for creds, visualizations with matplotlib, unit tests, improved error handling
 # Login OAuth required per user. Persistent token. All real API/ML logic.
 
 import requests
+from requests.adapters import HTTPAdapter
 import getpass
+import functools
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import json
+import atexit
+import queue
 import os
 import time
 import sys
 from datetime import datetime, timedelta
-from cryptography.fernet import Fernet
-import jwt
 import hmac
 import hashlib
+import secrets
+import base64
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
-import matplotlib.pyplot as plt
+from sklearn.cluster import MiniBatchKMeans
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 import http.server
-import socketserver
 import threading
 import webbrowser
 import urllib.parse
-import unittest
+import re
+
+# JSON (de)serialization for the encrypted stores and display; orjson is used when installed.
+# Both paths accept numpy scalars/arrays, which analysis results often contain.
+try:
+    import orjson
+
+    def _json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+
+    def format_json(obj):
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    def _json_default(obj):
+        if isinstance(obj, (np.generic, np.ndarray)):
+            return obj.tolist()
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def _json_dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), default=_json_default).encode()
+
+    def format_json(obj):
+        return json.dumps(obj, indent=2, default=_json_default)
+
+    _json_loads = json.loads
 
 # Load environment variables from .env file
 load_dotenv()
@@ -36,36 +69,138 @@ load_dotenv()
 # Configuration
 DATA_FILE = os.path.expanduser('~/.tiktok_kit_data.json')
 KEY_FILE = os.path.expanduser('~/.tiktok_kit_key.key')
+TREND_CACHE_FILE = os.path.expanduser('~/.tiktok_kit_trend_cache.json')  # Research API hashtag results by query
+ANALYSES_FILE = os.path.expanduser('~/.tiktok_kit_analyses.log')  # Append-only, length-prefixed AES-GCM blobs
 TIKTOK_API_BASE = "https://business-api.tiktok.com/open_api/v1.3"  # Confirmed as v1.3 in 2025 docs
 TIKTOK_OAUTH_BASE = "https://open.tiktokapis.com/v2/oauth"  # v2
 TIKTOK_RESEARCH_BASE = "https://open.tiktokapis.com/v2/research/video/query/"  # v2
 TIKTOK_SHOP_AFFILIATE_BASE = "https://partner.tiktokshop.com/api/v2"  # v2
 MIN_BUDGET = 1790  # Minimum budget in Rp
+AD_OBJECTIVES = frozenset({"TRAFFIC", "ENGAGEMENT", "FOLLOWERS"})  # Objectives offered by promosi_menu
+TREND_CACHE_TTL = 24 * 3600  # Seconds a cached hashtag ranking is reused
+TREND_WINDOW = timedelta(days=29)  # Default Research API window; the API caps ranges at 30 days
+RECENT_ANALYSES = 5  # Analyses kept in the data file for the dashboard
+MAX_ANALYSES = 200  # Analyses kept when the log is compacted, which happens every MAX_ANALYSES appends
 LOCAL_PORT = 8000  # Port for local OAuth callback server
 REDIRECT_URI = f"http://localhost:{LOCAL_PORT}/callback"
+EMIT_PLOTS = os.getenv("TIKTOK_KIT_PLOTS", "1") != "0"  # Set TIKTOK_KIT_PLOTS=0 to skip chart rendering
+TOKEN_EXPIRY_SKEW = 60  # Seconds before expiry at which access tokens are refreshed
+OAUTH_TIMEOUT = 300  # Seconds to wait for the browser to hit the callback
+VIDEO_ID_RE = re.compile(r"/(?:video|v)/(\d+)")  # Path segment holding the numeric video ID
+DATE_RE = re.compile(r"[0-9]{8}")  # YYYYMMDD input; use with fullmatch
+DIGITS_RE = re.compile(r"[0-9]+")  # ASCII digits only, so int() always succeeds
+OAUTH_SCOPES = "user.info.basic,video.list,ads.manage,research.data.basic,affiliate.seller"
+OAUTH_AUTHORIZE_URL = f"{TIKTOK_OAUTH_BASE}/authorize/?client_key={{client_key}}&scope={OAUTH_SCOPES}&response_type=code&redirect_uri={REDIRECT_URI}&state={{state}}&code_challenge={{code_challenge}}&code_challenge_method=S256"
+REQUEST_TIMEOUT = (3, 10)  # (connect, read) seconds for TikTok API calls
+ORDER_PAGE_SIZE = 100  # Orders requested per order/query page
+MAX_ORDER_PAGES = 20  # Cap on order/query pages per lookup, whatever total the server reports
 
-# Generate or rotate Fernet key if older than 30 days
-def manage_encryption_key():
-    """Manage encryption key: generate if not exists, rotate if old."""
-    if not os.path.exists(KEY_FILE):
-        key = Fernet.generate_key()
-        with open(KEY_FILE, 'wb') as f:
-            f.write(key)
-        os.chmod(KEY_FILE, 0o600)
-    else:
-        key_age = time.time() - os.path.getmtime(KEY_FILE)
-        if key_age > 30 * 24 * 3600:  # Rotate every 30 days
-            os.remove(KEY_FILE)
-            key = Fernet.generate_key()
-            with open(KEY_FILE, 'wb') as f:
-                f.write(key)
-            os.chmod(KEY_FILE, 0o600)
-            print(f"{Colors.WARNING}Encryption key rotated.{Colors.ENDC}")
+# Shared HTTP session so repeated calls to the same TikTok host reuse the TLS connection
+SESSION = requests.Session()
+# One pool per TikTok host; 8 per pool covers affiliate_booster's link call plus concurrent order pages
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+SESSION.headers.update({"User-Agent": "ttkit/2.2"})
+atexit.register(SESSION.close)
+
+class _Cipher:
+    """AES-256-GCM over the current key; blobs are nonce + ciphertext, no base64. Retired keys still decrypt."""
+
+    def __init__(self, keys):
+        from cryptography.fernet import Fernet, MultiFernet
+        from cryptography.exceptions import InvalidTag
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        self._aeads = [AESGCM(base64.urlsafe_b64decode(key)) for key in keys]  # Current key first
+        self._legacy = MultiFernet([Fernet(key) for key in keys])  # Data written before the switch to AES-GCM
+        self._errors = (InvalidTag, ValueError)
 
-    with open(KEY_FILE, 'rb') as f:
-        return Fernet(f.read())
+    def encrypt(self, data):
+        nonce = os.urandom(12)
+        return nonce + self._aeads[0].encrypt(nonce, data, None)
 
-fernet = manage_encryption_key()
+    def decrypt(self, blob):
+        for aead in self._aeads:
+            try:
+                return aead.decrypt(blob[:12], blob[12:], None)
+            except self._errors:
+                continue
+        return self._legacy.decrypt(blob)
+
+def _is_transient(exc):
+    """Retry timeouts, dropped connections, 429 and 5xx; other client errors fail fast."""
+    if isinstance(exc, requests.HTTPError):
+        status = exc.response.status_code if exc.response is not None else 0
+        return status == 429 or status >= 500
+    return isinstance(exc, (requests.ConnectionError, requests.Timeout))
+
+def session_post(url, json=None, headers=None, **kwargs):
+    """POST once through the shared session; a json= body is serialized with _json_dumps."""
+    if json is not None:
+        kwargs["data"] = _json_dumps(json)
+        headers = {**(headers or {}), "Content-Type": "application/json"}
+    return SESSION.post(url, headers=headers, timeout=REQUEST_TIMEOUT, **kwargs)
+
+def response_json(resp):
+    """Decode a response body with _json_loads; malformed bodies raise requests.JSONDecodeError like resp.json()."""
+    try:
+        return _json_loads(resp.content)
+    except ValueError as e:
+        raise requests.JSONDecodeError(str(e), "", 0) from e
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), retry=retry_if_exception(_is_transient), reraise=True)
+def api_post(url, **kwargs):
+    """POST through the shared session, retrying transient failures; raises on HTTP errors."""
+    resp = session_post(url, **kwargs)
+    resp.raise_for_status()
+    return resp
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10), retry=retry_if_exception(_is_transient), reraise=True)
+def api_get(url, **kwargs):
+    """GET through the shared session, retrying transient failures; raises on HTTP errors."""
+    resp = SESSION.get(url, timeout=REQUEST_TIMEOUT, **kwargs)
+    resp.raise_for_status()
+    return resp
+
+def api_errors(context, default=None):
+    """Report HTTP/request failures of the wrapped call as '<HTTP|Request> error <context>' and return default."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            try:
+                return fn(*args, **kwargs)
+            except requests.RequestException as e:
+                kind = "HTTP" if isinstance(e, requests.HTTPError) else "Request"
+                print(f"{Colors.FAIL}{kind} error {context}: {e}{Colors.ENDC}")
+                return default
+        return wrapper
+    return decorate
+
+_KEY_LOCK = threading.Lock()  # Serializes key creation/rotation when worker threads race on a cold cache
+
+# Generate or rotate the encryption key if older than 30 days
+@functools.lru_cache(maxsize=1)
+def _get_cipher():
+    """Manage encryption key: generate if not exists, rotate if old. Cached per process."""
+    with _KEY_LOCK:
+        # One key per line, current first; retired keys stay so older files and log frames remain readable
+        try:
+            with open(KEY_FILE, 'rb') as f:
+                keys = f.read().split()
+            key_age = time.time() - os.path.getmtime(KEY_FILE)
+        except FileNotFoundError:
+            keys, key_age = [], None
+        if not keys or key_age is None or key_age > 30 * 24 * 3600:  # Create, or rotate every 30 days
+            keys.insert(0, base64.urlsafe_b64encode(os.urandom(32)))
+            tmp = KEY_FILE + ".tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            try:
+                _write_all(fd, b"\n".join(keys) + b"\n")
+                os.fsync(fd)  # Losing a new key would make everything saved with it unreadable
+            finally:
+                os.close(fd)
+            os.replace(tmp, KEY_FILE)
+            if len(keys) > 1:
+                print(f"{Colors.WARNING}Encryption key rotated.{Colors.ENDC}")
+        return _Cipher(keys)
 
 # ANSI Colors
 class Colors:
@@ -95,92 +230,406 @@ BORDER = f"{Colors.OKBLUE}╔{'═' * 60}╗{Colors.ENDC}"
 BORDER_LINE = f"{Colors.OKBLUE}║{' ' * 60}║{Colors.ENDC}"
 BORDER_END = f"{Colors.OKBLUE}╚{'═' * 60}╝{Colors.ENDC}"
 
-def print_header():
-    """Print the ASCII art header."""
-    print(ASCII_ART)
-
-def print_menu_border(title):
-    """Print bordered menu title."""
-    print(BORDER)
-    print(f"{Colors.OKBLUE}║{Colors.BOLD} {title.center(58)} {Colors.ENDC}{Colors.OKBLUE}║{Colors.ENDC}")
-    print(BORDER_LINE)
-
-def loading_spinner(msg, duration=2):
-    """Display a loading spinner."""
-    print(f"{Colors.WARNING}{msg} ", end='', flush=True)
-    spinner = "|/-\\"
-    for _ in range(duration * 10):
-        for char in spinner:
-            sys.stdout.write(f"\r{Colors.WARNING}{msg} {char}{Colors.ENDC}")
-            sys.stdout.flush()
-            time.sleep(0.1)
-    print(f"\r{Colors.OKGREEN}{msg} ✓{Colors.ENDC}")
+# Main menu screen (header, title border and options), encoded once and written in a single call per render
+MAIN_MENU_OPTIONS = [
+    "1. Login TikTok OAuth (Required First)",
+    "2. Dashboard",
+    "3. Generate Content (Trend-Based)",
+    "4. Analyze Video",
+    "5. Performance Tracking",
+    "6. Account Management",
+    "7. Logout",
+    "8. Promote TikTok Ads",
+    "9. Set Credentials",
+    "10. Analyze FYP/Keywords/Hashtags",
+    "11. Affiliate Booster",
+    "12. Run Unit Tests",
+    "0. Exit",
+]
+
+def write_bytes(data):
+    """Write pre-encoded output straight to the stdout buffer."""
+    sys.stdout.flush()  # Keep ordering with text already printed
+    out = getattr(sys.stdout, 'buffer', None)
+    if out is None:  # Text-only stream, e.g. a captured stdout
+        sys.stdout.write(data.decode())
+        sys.stdout.flush()
+        return
+    out.write(data)
+    out.flush()
+
+def menu_border(title):
+    """Return the bordered menu title block."""
+    return f"{BORDER}\n{Colors.OKBLUE}║{Colors.BOLD} {title.center(58)} {Colors.ENDC}{Colors.OKBLUE}║{Colors.ENDC}\n{BORDER_LINE}\n"
+
+MAIN_MENU_BYTES = (
+    f"{ASCII_ART}\n"
+    + menu_border("ADVANCED MENU v2.2")
+    + "".join(f"{Colors.OKBLUE}{option}{Colors.ENDC}\n" for option in MAIN_MENU_OPTIONS)
+    + f"{BORDER_END}\n"
+).encode()
+
+@contextmanager
+def loading_spinner(msg):
+    """Display a loading spinner while the wrapped block runs."""
+    done = threading.Event()
+    frames = [f"\r{Colors.WARNING}{msg} {char}{Colors.ENDC}".encode() for char in "|/-\\"]
+    sys.stdout.flush()  # Frames bypass the text layer, so empty it first
+    out = getattr(sys.stdout, 'buffer', None)
+    if out is None:  # Text-only stream, e.g. a captured stdout
+        out = sys.stdout
+        frames = [frame.decode() for frame in frames]
+
+    def spin():
+        for frame in itertools.cycle(frames):
+            if done.wait(0.1):  # Work that finishes within 0.1s never draws a frame
+                break
+            out.write(frame)
+            out.flush()
+
+    thread = None
+    if sys.stdout.isatty():  # Piped or captured output gets only the final status line
+        thread = threading.Thread(target=spin, daemon=True)
+        thread.start()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        done.set()
+        if thread is not None:
+            thread.join()
+        if ok:
+            print(f"\r{Colors.OKGREEN}{msg} ✓{Colors.ENDC}")
+        else:
+            print(f"\r{Colors.FAIL}{msg} ✗{Colors.ENDC}")
+
+@functools.lru_cache(maxsize=1)
+def _pyplot():
+    """Import matplotlib on first use with the non-interactive Agg backend."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+@contextmanager
+def saved_chart(path, title, xlabel, ylabel):
+    """Yield axes for one chart, then label it, save it to path and close it."""
+    plt = _pyplot()
+    fig, ax = plt.subplots()
+    try:
+        yield ax
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+        fig.tight_layout()
+        fig.savefig(path)
+    finally:
+        plt.close(fig)
+
+# In-memory copy of the decrypted data file, keyed on its mtime, plus the serialized
+# form last read or saved so unchanged snapshots are not rewritten
+_CACHE = {"data": None, "mtime": None, "payload": None}
+
+def _empty_data():
+    """Return a fresh, empty data structure."""
+    return {"users": {}, "creds": {}, "current_user": None, "analysis_counts": {}, "recent_analyses": []}
+
+# Files written since the last fsync; flushed to disk once at exit
+_UNSYNCED = set()
+
+def _write_all(fd, buf):
+    """Write the whole buffer to a raw file descriptor."""
+    view = memoryview(buf)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _sync_files():
+    """Fsync files written during this run, plus their directory for the renames."""
+    for path in sorted(_UNSYNCED | {os.path.dirname(p) for p in _UNSYNCED}):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue  # Directories cannot be opened on every platform
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+    _UNSYNCED.clear()
+
+atexit.register(_sync_files)
+
+# Serialized snapshots waiting for the background writer to encrypt and save
+_WRITE_Q = queue.Queue(maxsize=1)
+
+def _write_data_file(cipher, payload):
+    """Encrypt a serialized snapshot and atomically replace DATA_FILE with it."""
+    encrypted = cipher.encrypt(payload)
+    tmp = DATA_FILE + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        _write_all(fd, encrypted)
+        _CACHE["mtime"] = os.fstat(fd).st_mtime_ns
+    finally:
+        os.close(fd)
+    os.chmod(tmp, 0o600)
+    os.replace(tmp, DATA_FILE)  # Atomic: readers see the old or the new file, never a partial one
+    _UNSYNCED.add(DATA_FILE)
+
+# Failure from the background writer, reported by the next save or flush
+_WRITE_ERROR = {"exc": None}
+
+def _data_writer():
+    """Background thread: save queued snapshots in order."""
+    while True:
+        cipher, payload = _WRITE_Q.get()
+        try:
+            _write_data_file(cipher, payload)
+        except Exception as e:
+            # Not on disk: drop the cached copy so nothing treats it as saved
+            _CACHE.update(data=None, mtime=None, payload=None)
+            _WRITE_ERROR["exc"] = e
+        finally:
+            _WRITE_Q.task_done()
+
+threading.Thread(target=_data_writer, name="data-writer", daemon=True).start()
+
+def _raise_write_error():
+    """Exit if a background save failed; that snapshot never reached disk."""
+    exc = _WRITE_ERROR["exc"]
+    if exc is not None:
+        _WRITE_ERROR["exc"] = None
+        print(f"{Colors.FAIL}Encryption error: {exc}. Changes were not saved.{Colors.ENDC}")
+        sys.exit(1)
+
+def flush_data():
+    """Block until every queued save has been written."""
+    _WRITE_Q.join()
+    _raise_write_error()
+
+atexit.register(flush_data)  # Runs before _sync_files (atexit is LIFO)
 
 def encrypt_data(data):
-    """Encrypt and save data to file."""
+    """Snapshot data and hand it to the background writer to encrypt and save."""
+    _raise_write_error()
     try:
-        json_str = json.dumps(data)
-        encrypted = fernet.encrypt(json_str.encode())
-        with open(DATA_FILE, 'wb') as f:
-            f.write(encrypted)
-        os.chmod(DATA_FILE, 0o600)
+        payload = _json_dumps(data)
+        cipher = _get_cipher()  # Load the key here, never concurrently from the writer
     except Exception as e:
         print(f"{Colors.FAIL}Encryption error: {e}{Colors.ENDC}")
         sys.exit(1)
+    _CACHE["data"] = data
+    if payload == _CACHE["payload"]:
+        return  # Nothing changed since the last read or save
+    _CACHE["payload"] = payload
+    _WRITE_Q.put((cipher, payload))
 
 def load_data():
-    """Load and decrypt data from file."""
-    if os.path.exists(DATA_FILE):
+    """Load data for reading, reusing the cached copy if the file is unchanged."""
+    try:
+        mtime = os.stat(DATA_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return load_data_fresh()  # The first save may still be queued
+    if _CACHE["data"] is not None and _CACHE["mtime"] == mtime:
+        return _CACHE["data"]
+    return load_data_fresh()
+
+def load_data_fresh():
+    """Read and decrypt data from file, bypassing and then refreshing the cache."""
+    flush_data()  # Never read behind a queued save
+    try:
+        mtime = os.stat(DATA_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return _empty_data()
+    try:
+        with open(DATA_FILE, 'rb') as f:
+            encrypted = f.read()
+        payload = _get_cipher().decrypt(encrypted)
+        data = _json_loads(payload)
+    except Exception as e:
+        print(f"{Colors.FAIL}Data load error: {e}. Resetting data.{Colors.ENDC}")
+        return _empty_data()
+    _CACHE["data"] = data
+    _CACHE["mtime"] = mtime
+    _CACHE["payload"] = payload
+    if "analyses" in data:
+        _migrate_analyses(data)
+    return data
+
+@contextmanager
+def mutate_data():
+    """Load data once, yield it for changes and save it once on success."""
+    data = load_data_fresh()
+    yield data
+    encrypt_data(data)
+
+# Size of ANALYSES_FILE after our last write, which ends on a frame boundary
+_LOG_SIZE = {"end": None}
+
+def _append_frames(entries):
+    """Append analyses to ANALYSES_FILE as length-prefixed encrypted blobs in one write."""
+    frames = []
+    for entry in entries:
+        token = _get_cipher().encrypt(_json_dumps(entry))
+        frames.append(len(token).to_bytes(4, 'big') + token)
+    fd = os.open(ANALYSES_FILE, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o600)
+    try:
+        size = os.fstat(fd).st_size
+        if size != _LOG_SIZE["end"]:  # Not last written by us; check for a torn final frame
+            with os.fdopen(fd, 'rb', closefd=False) as f:
+                end = _log_end(f)
+            if end < size:  # Otherwise the new frames would be read as the torn frame's body
+                os.ftruncate(fd, end)
+                print(f"{Colors.WARNING}Dropped an incomplete analysis record.{Colors.ENDC}")
+        _write_all(fd, b"".join(frames))
+        _LOG_SIZE["end"] = os.fstat(fd).st_size
+    finally:
+        os.close(fd)
+    _UNSYNCED.add(ANALYSES_FILE)
+
+def _log_frames(f):
+    """Yield (offset, length) of each complete blob in an open analyses log."""
+    size = os.fstat(f.fileno()).st_size
+    pos = 0
+    while pos + 4 <= size:
+        f.seek(pos)
+        length = int.from_bytes(f.read(4), 'big')
+        if pos + 4 + length > size:  # Torn final frame from an interrupted write
+            return
+        yield pos + 4, length
+        pos += 4 + length
+
+def _log_end(f):
+    """Offset just past the last complete frame of an open analyses log."""
+    end = 0
+    for offset, length in _log_frames(f):
+        end = offset + length
+    return end
+
+def _compact_analyses():
+    """Atomically rewrite ANALYSES_FILE with its newest MAX_ANALYSES complete frames, copied undecrypted."""
+    with open(ANALYSES_FILE, 'rb') as f:
+        frames = []
+        for offset, length in deque(_log_frames(f), maxlen=MAX_ANALYSES):  # A torn final frame is left out
+            f.seek(offset - 4)
+            frames.append(f.read(4 + length))
+    blob = b"".join(frames)
+    tmp = ANALYSES_FILE + ".tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        _write_all(fd, blob)
+    finally:
+        os.close(fd)
+    os.replace(tmp, ANALYSES_FILE)
+    _LOG_SIZE["end"] = len(blob)
+    _UNSYNCED.add(ANALYSES_FILE)
+
+def _migrate_analyses(data):
+    """Move a legacy in-file analyses list to the append-only log."""
+    legacy = data.pop("analyses")
+    counts = data.setdefault("analysis_counts", {})
+    if legacy:
+        _append_frames(legacy)
+        for entry in legacy:
+            counts[entry.get("type")] = counts.get(entry.get("type"), 0) + 1
+    data["recent_analyses"] = legacy[-RECENT_ANALYSES:]
+    encrypt_data(data)
+
+def append_analysis(entry):
+    """Record an analysis without rewriting the analyses history."""
+    try:
+        _append_frames([entry])
+    except Exception as e:
+        print(f"{Colors.FAIL}Encryption error: {e}{Colors.ENDC}")
+        sys.exit(1)
+    with mutate_data() as data:
+        counts = data.setdefault("analysis_counts", {})
+        counts[entry["type"]] = counts.get(entry["type"], 0) + 1
+        data["recent_analyses"] = (data.get("recent_analyses", []) + [entry])[-RECENT_ANALYSES:]
+        total = sum(counts.values())
+    if total % MAX_ANALYSES == 0:  # Keeps the log, and dashboard fallback scans, bounded
         try:
-            with open(DATA_FILE, 'rb') as f:
-                encrypted = f.read()
-            decrypted = fernet.decrypt(encrypted).decode()
-            return json.loads(decrypted)
-        except Exception as e:
-            print(f"{Colors.FAIL}Data load error: {e}. Resetting data.{Colors.ENDC}")
-            return {"users": {}, "analyses": [], "creds": {}, "current_user": None}
-    return {"users": {}, "analyses": [], "creds": {}, "current_user": None}
+            _compact_analyses()
+        except OSError:
+            pass  # The full log is still intact; retry at the next threshold
+
+def iter_analyses(last=None):
+    """Lazily decrypt analyses from the log, only the newest `last` ones if given."""
+    try:
+        f = open(ANALYSES_FILE, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        # Offsets are read up front so decrypting never interleaves with header seeks
+        selected = deque(_log_frames(f), maxlen=last) if last is not None else list(_log_frames(f))
+        for offset, length in selected:
+            f.seek(offset)
+            try:
+                yield _json_loads(_get_cipher().decrypt(f.read(length)))
+            except Exception as e:
+                print(f"{Colors.FAIL}Analysis load error: {e}{Colors.ENDC}")
+
+def read_analyses(last=None):
+    """Decrypt analyses from the log into a list, only the newest `last` ones if given."""
+    return list(iter_analyses(last))
 
 def get_user_data(username):
     """Get user data from loaded data."""
     data = load_data()
     return data["users"].get(username, {})
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def refresh_token_if_needed(user_data):
-    """Refresh access token if expired."""
-    try:
-        access_token = user_data.get('tiktok_access_token')
-        expires_at = user_data.get('expires_at')
-        if not access_token or not expires_at:
-            return False
-        if datetime.now() > datetime.fromisoformat(expires_at):
-            refresh_token = user_data.get('refresh_token')
-            if refresh_token:
+# Expiry of the last access token seen valid, so repeat checks skip parsing
+_TOKEN_CACHE = {"token": None, "expires_at": 0.0}
+
+def _remember_token(user_data):
+    """Cache the access token's expiry as an epoch timestamp."""
+    _TOKEN_CACHE["token"] = user_data['tiktok_access_token']
+    _TOKEN_CACHE["expires_at"] = datetime.fromisoformat(user_data['expires_at']).timestamp()
+
+@api_errors("during token refresh", default=False)
+def refresh_token_if_needed(user_data, creds=None):
+    """Refresh access token if expired; pass creds when the caller already loaded them."""
+    access_token = user_data.get('tiktok_access_token')
+    expires_at = user_data.get('expires_at')
+    if not access_token or not expires_at:
+        return False
+    now = time.time()
+    if access_token == _TOKEN_CACHE["token"] and now < _TOKEN_CACHE["expires_at"] - TOKEN_EXPIRY_SKEW:
+        return True
+    expires_ts = datetime.fromisoformat(expires_at).timestamp()
+    if now >= expires_ts - TOKEN_EXPIRY_SKEW:  # Refresh shortly before expiry, not after a failed call
+        refresh_token = user_data.get('refresh_token')
+        if refresh_token:
+            if creds is None:
                 creds = load_data().get("creds", {})
-                exchange_data = {
-                    "client_key": creds.get('tiktok_app_id'),
-                    "client_secret": creds.get('tiktok_app_secret'),
-                    "refresh_token": refresh_token,
-                    "grant_type": "refresh_token"
-                }
-                resp = requests.post(f"{TIKTOK_OAUTH_BASE}/token/", json=exchange_data)
-                resp.raise_for_status()
-                token_data = resp.json()
-                user_data['tiktok_access_token'] = token_data.get("access_token")
-                user_data['refresh_token'] = token_data.get("refresh_token", refresh_token)
-                user_data['expires_at'] = (datetime.now() + timedelta(seconds=token_data.get("expires_in", 7200))).isoformat()
-                data = load_data()
+            exchange_data = {
+                "client_key": creds.get('tiktok_app_id'),
+                "client_secret": creds.get('tiktok_app_secret'),
+                "refresh_token": refresh_token,
+                "grant_type": "refresh_token"
+            }
+            token_data = response_json(api_post(f"{TIKTOK_OAUTH_BASE}/token/", json=exchange_data))
+            user_data['tiktok_access_token'] = token_data.get("access_token")
+            user_data['refresh_token'] = token_data.get("refresh_token", refresh_token)
+            user_data['expires_at'] = (datetime.now() + timedelta(seconds=token_data.get("expires_in", 7200))).isoformat()
+            with mutate_data() as data:
                 data["users"][data["current_user"]] = user_data
-                encrypt_data(data)
-                return True
-        return True
-    except requests.HTTPError as e:
-        print(f"{Colors.FAIL}HTTP error during token refresh: {e}{Colors.ENDC}")
-        return False
-    except requests.RequestException as e:
-        print(f"{Colors.FAIL}Request error during token refresh: {e}{Colors.ENDC}")
-        return False
+            _remember_token(user_data)
+            return True
+        return now < expires_ts  # No refresh token: usable until it actually expires
+    _remember_token(user_data)
+    return True
+
+def tiktok_video_id(url):
+    """Return the numeric video ID from a tiktok.com video URL, or None."""
+    parsed = urllib.parse.urlparse(url if "://" in url else f"https://{url}")
+    host = parsed.hostname or ""
+    if host != "tiktok.com" and not host.endswith(".tiktok.com"):
+        return None
+    match = VIDEO_ID_RE.search(parsed.path)
+    return match.group(1) if match else None
 
 def validate_input(prompt, validator=None, required=True):
     """Validate user input with optional validator."""
@@ -194,25 +643,33 @@ def validate_input(prompt, validator=None, required=True):
             continue
         return value
 
+def format_analysis_date(entry):
+    """Format an analysis timestamp for display; older entries store an ISO string."""
+    if "date_ns" in entry:
+        return datetime.fromtimestamp(entry["date_ns"] / 1e9).isoformat(timespec='seconds')
+    return entry.get("date", "")
+
 def show_dashboard(username):
     """Display enterprise dashboard with analytics."""
     print(f"{Colors.OKBLUE}=== ENTERPRISE DASHBOARD ==={Colors.ENDC}")
-    data = load_data()
-    analyses = data.get("analyses", [])
     try:
-        loading_spinner("Loading dashboard with analytics...")
-        df = pd.DataFrame(analyses)
-        if not df.empty:
-            print(f"{Colors.BOLD}Total Analyses: {len(df)}{Colors.ENDC}")
-            print(df.tail(5)[['type', 'date', 'summary']].to_string(index=False))
-            print(f"{Colors.BOLD}Top Trends: {df['type'].value_counts().to_dict()}{Colors.ENDC}")
+        with loading_spinner("Loading dashboard with analytics..."):
+            data = load_data()
+            counts = data.get("analysis_counts", {})
+            recent = data.get("recent_analyses")
+            if recent is None:
+                recent = read_analyses(last=RECENT_ANALYSES)
+        if recent:
+            type_counts = dict(sorted(counts.items(), key=lambda item: item[1], reverse=True))
+            print(f"{Colors.BOLD}Total Analyses: {sum(type_counts.values())}{Colors.ENDC}")
+            for entry in recent:
+                print(f"{entry.get('type', ''):<18}  {format_analysis_date(entry):<19}  {entry.get('summary', '')}")
+            print(f"{Colors.BOLD}Top Trends: {type_counts}{Colors.ENDC}")
             # Visualization
-            df['type'].value_counts().plot(kind='bar')
-            plt.title('Analysis Types Distribution')
-            plt.xlabel('Type')
-            plt.ylabel('Count')
-            plt.savefig('dashboard_types.png')
-            print(f"{Colors.OKGREEN}Saved visualization to 'dashboard_types.png'{Colors.ENDC}")
+            if EMIT_PLOTS:
+                with saved_chart('dashboard_types.png', 'Analysis Types Distribution', 'Type', 'Count') as ax:
+                    ax.bar(list(type_counts), list(type_counts.values()))
+                print(f"{Colors.OKGREEN}Saved visualization to 'dashboard_types.png'{Colors.ENDC}")
         else:
             print(f"{Colors.WARNING}No analyses yet.{Colors.ENDC}")
     except Exception as e:
@@ -222,9 +679,10 @@ def generate_content(username):
     """Generate AI-enhanced content based on trends."""
     print(f"{Colors.OKBLUE}=== AI-ENHANCED CONTENT GENERATION ==={Colors.ENDC}")
     try:
-        start_date = validate_input("Start date (YYYYMMDD): ", lambda x: len(x) == 8 and x.isdigit(), required=True)
-        end_date = validate_input("End date (YYYYMMDD, max 30 days after start): ", lambda x: len(x) == 8 and x.isdigit(), required=True)
-        trends = fetch_trending_hashtags("ID", start_date, end_date, limit=5)
+        start_date = validate_input("Start date (YYYYMMDD): ", DATE_RE.fullmatch, required=True)
+        end_date = validate_input("End date (YYYYMMDD, max 30 days after start): ", DATE_RE.fullmatch, required=True)
+        with loading_spinner("Fetching trends via Research API..."):
+            trends = fetch_trending_hashtags("ID", start_date, end_date, limit=5)
         product_desc = validate_input("Product description: ")
         niche = validate_input("Niche: ")
         target_audience = validate_input("Target audience: ")
@@ -234,15 +692,13 @@ def generate_content(username):
             "captions": [f"Promo {product_desc}! #{trends[0]['name']} #fyp"],
             "hashtags": [t['name'] for t in trends]
         }
-        data = load_data()
-        data["analyses"].append({
+        append_analysis({
             "type": "content_generation",
-            "date": datetime.now().isoformat(),
+            "date_ns": time.time_ns(),
             "summary": f"Generated for {product_desc} with {len(trends)} trends",
             "data": content
         })
-        encrypt_data(data)
-        print(json.dumps(content, indent=2))
+        print(format_json(content))
     except ValueError as e:
         print(f"{Colors.FAIL}Input validation error: {e}{Colors.ENDC}")
     except requests.RequestException as e:
@@ -252,13 +708,13 @@ def analyze_video(username):
     """Analyze TikTok video performance."""
     print(f"{Colors.OKBLUE}=== VIDEO ANALYSIS ==={Colors.ENDC}")
     try:
-        video_url = validate_input("TikTok video URL: ", lambda x: 'tiktok.com' in x)
-        video_id = video_url.split('/')[-1].split('?')[0]
-        start_date = validate_input("Start date (YYYYMMDD): ", lambda x: len(x) == 8 and x.isdigit(), required=True)
-        end_date = validate_input("End date (YYYYMMDD): ", lambda x: len(x) == 8 and x.isdigit(), required=True)
+        video_url = validate_input("TikTok video URL: ", lambda x: tiktok_video_id(x) is not None)
+        video_id = tiktok_video_id(video_url)
+        start_date = validate_input("Start date (YYYYMMDD): ", DATE_RE.fullmatch, required=True)
+        end_date = validate_input("End date (YYYYMMDD): ", DATE_RE.fullmatch, required=True)
         niche = validate_input("Niche (optional): ", required=False) or None
-        loading_spinner("Analyzing with Research API...")
-        video_data = fetch_video_data(video_id, start_date, end_date)
+        with loading_spinner("Analyzing with Research API..."):
+            video_data = fetch_video_data(video_id, start_date, end_date)
         if not video_data:
             print(f"{Colors.FAIL}No video data found.{Colors.ENDC}")
             return
@@ -268,21 +724,19 @@ def analyze_video(username):
             "video_data": {"views": views, "likes": likes, "niche_score": np.random.uniform(0.7, 0.95) if niche else 0},
             "insights": f"High engagement in {niche}: {likes/views*100:.1f}% like rate" if views > 0 else "No views"
         }
-        data = load_data()
-        data["analyses"].append({
+        append_analysis({
             "type": "video_analysis",
-            "date": datetime.now().isoformat(),
+            "date_ns": time.time_ns(),
             "summary": f"Analyzed {video_url}: {views:,} views",
             "data": analysis
         })
-        encrypt_data(data)
-        print(json.dumps(analysis, indent=2))
+        print(format_json(analysis))
     except requests.RequestException as e:
         print(f"{Colors.FAIL}API error during video analysis: {e}{Colors.ENDC}")
     except Exception as e:
         print(f"{Colors.FAIL}Video analysis error: {e}{Colors.ENDC}")
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+@api_errors("in Research API")
 def fetch_video_data(video_id, start_date, end_date):
     """Fetch video data from Research API."""
     data = load_data()
@@ -291,7 +745,7 @@ def fetch_video_data(video_id, start_date, end_date):
     if not research_token:
         print(f"{Colors.FAIL}Research access token required.{Colors.ENDC}")
         return None
-    headers = {"Authorization": f"Bearer {research_token}", "Content-Type": "application/json"}
+    headers = {"Authorization": f"Bearer {research_token}"}
     body = {
         "query": {"and": [{"operation": "EQ", "field_name": "video_id", "field_values": [video_id]}]},
         "start_date": start_date,
@@ -299,60 +753,43 @@ def fetch_video_data(video_id, start_date, end_date):
         "max_count": 1,
         "fields": "id,view_count,like_count"
     }
-    try:
-        resp = requests.post(TIKTOK_RESEARCH_BASE, headers=headers, json=body)
-        resp.raise_for_status()
-        videos = resp.json().get("data", {}).get("videos", [])
-        return videos[0] if videos else None
-    except requests.HTTPError as e:
-        print(f"{Colors.FAIL}HTTP error in Research API: {e}{Colors.ENDC}")
-        return None
-    except requests.RequestException as e:
-        print(f"{Colors.FAIL}Request error in Research API: {e}{Colors.ENDC}")
-        return None
+    videos = response_json(api_post(TIKTOK_RESEARCH_BASE, headers=headers, json=body)).get("data", {}).get("videos", [])
+    return videos[0] if videos else None
 
+@api_errors("fetching performance")
 def performance_tracking(username):
     """Track ad performance."""
     print(f"{Colors.OKBLUE}=== PERFORMANCE TRACKING ==={Colors.ENDC}")
-    try:
-        user_data = get_user_data(username)
-        if not refresh_token_if_needed(user_data):
-            print(f"{Colors.FAIL}Token refresh failed.{Colors.ENDC}")
-            return
-        data = load_data()
-        creds = data.get("creds", {})
-        advertiser_id = creds.get('tiktok_advertiser_id')
-        if not advertiser_id:
-            print(f"{Colors.FAIL}Advertiser ID required.{Colors.ENDC}")
-            return
-        headers = {"Access-Token": user_data['tiktok_access_token']}
-        resp = requests.get(f"{TIKTOK_API_BASE}/campaign/get/?advertiser_id={advertiser_id}&limit=10", headers=headers)
-        resp.raise_for_status()
-        campaigns = resp.json().get("data", {}).get("list", [])
-        df = pd.DataFrame(campaigns)
-        if not df.empty:
-            print(df[['campaign_name', 'status', 'spend']].to_string(index=False))
-            # Visualization
-            df.plot(x='campaign_name', y='spend', kind='bar')
-            plt.title('Campaign Spend')
-            plt.xlabel('Campaign')
-            plt.ylabel('Spend')
-            plt.savefig('campaign_spend.png')
+    data = load_data()
+    creds = data.get("creds", {})
+    user_data = data["users"].get(username, {})
+    if not refresh_token_if_needed(user_data, creds):
+        print(f"{Colors.FAIL}Token refresh failed.{Colors.ENDC}")
+        return
+    advertiser_id = creds.get('tiktok_advertiser_id')
+    if not advertiser_id:
+        print(f"{Colors.FAIL}Advertiser ID required.{Colors.ENDC}")
+        return
+    headers = {"Access-Token": user_data['tiktok_access_token']}
+    with loading_spinner("Loading campaigns..."):
+        resp = api_get(f"{TIKTOK_API_BASE}/campaign/get/?advertiser_id={advertiser_id}&limit=10", headers=headers)
+    campaigns = response_json(resp).get("data", {}).get("list", [])
+    df = pd.DataFrame(campaigns)
+    if not df.empty:
+        print(df[['campaign_name', 'status', 'spend']].to_string(index=False))
+        # Visualization
+        if EMIT_PLOTS:
+            with saved_chart('campaign_spend.png', 'Campaign Spend', 'Campaign', 'Spend') as ax:
+                df.plot(x='campaign_name', y='spend', kind='bar', ax=ax)
             print(f"{Colors.OKGREEN}Saved visualization to 'campaign_spend.png'{Colors.ENDC}")
-        else:
-            print(f"{Colors.WARNING}No campaigns found.{Colors.ENDC}")
-    except requests.HTTPError as e:
-        print(f"{Colors.FAIL}HTTP error fetching performance: {e}{Colors.ENDC}")
-    except requests.RequestException as e:
-        print(f"{Colors.FAIL}Request error fetching performance: {e}{Colors.ENDC}")
+    else:
+        print(f"{Colors.WARNING}No campaigns found.{Colors.ENDC}")
 
 def account_management(username):
     """Manage user account."""
     print(f"{Colors.OKBLUE}=== ACCOUNT MANAGEMENT ==={Colors.ENDC}")
     try:
-        data = load_data()
-        user_data = data["users"].get(username, {})
-        loading_spinner("Loading account...")
+        user_data = get_user_data(username)
         print(f"{Colors.BOLD}Tier: Enterprise | Token Expiry: {user_data.get('expires_at', 'N/A')}{Colors.ENDC}")
         choice = validate_input("1. Refresh Token | 2. Logout: ", lambda x: x in ['1', '2'])
         if choice == '1':
@@ -365,24 +802,37 @@ def account_management(username):
     except Exception as e:
         print(f"{Colors.FAIL}Account management error: {e}{Colors.ENDC}")
 
+# (creds key, .env variable, prompt, input kind) in prompt order
+CRED_FIELDS = (
+    ('tiktok_app_id', 'TIKTOK_APP_ID', "TikTok APP ID: ", "required"),
+    ('tiktok_app_secret', 'TIKTOK_APP_SECRET', "TikTok APP Secret: ", "secret"),
+    ('tiktok_advertiser_id', 'TIKTOK_ADVERTISER_ID', "Advertiser ID: ", "required"),
+    ('research_access_token', 'RESEARCH_ACCESS_TOKEN', "Research Access Token (optional): ", "optional"),
+    ('shop_app_id', 'SHOP_APP_ID', "Shop APP ID (for affiliate): ", "required"),
+    ('shop_secret', 'SHOP_SECRET', "Shop Secret: ", "secret"),
+)
+REQUIRED_CREDS = ('tiktok_app_id', 'tiktok_app_secret', 'tiktok_advertiser_id')
+
 def set_credentials():
     """Set TikTok credentials, prefer .env if available."""
     print(f"{Colors.OKBLUE}=== SET CREDENTIALS ==={Colors.ENDC}")
     try:
-        data = load_data()
-        creds = data.get("creds", {})
-        print("Get from developers.tiktok.com & business.tiktok.com")
-        creds['tiktok_app_id'] = os.getenv('TIKTOK_APP_ID') or validate_input("TikTok APP ID: ")
-        creds['tiktok_app_secret'] = os.getenv('TIKTOK_APP_SECRET') or getpass.getpass("TikTok APP Secret: ")
-        creds['tiktok_advertiser_id'] = os.getenv('TIKTOK_ADVERTISER_ID') or validate_input("Advertiser ID: ")
-        creds['research_access_token'] = os.getenv('RESEARCH_ACCESS_TOKEN') or validate_input("Research Access Token (optional): ", required=False)
-        creds['shop_app_id'] = os.getenv('SHOP_APP_ID') or validate_input("Shop APP ID (for affiliate): ")
-        creds['shop_secret'] = os.getenv('SHOP_SECRET') or getpass.getpass("Shop Secret: ")
-        if not creds.get('tiktok_app_id') or not creds.get('tiktok_app_secret') or not creds.get('tiktok_advertiser_id'):
+        creds = {key: os.getenv(env_var) for key, env_var, _, _ in CRED_FIELDS}
+        # Fully configured .env: save without prompting; otherwise ask for whatever is unset
+        if not all(creds[key] for key in REQUIRED_CREDS):
+            print("Get from developers.tiktok.com & business.tiktok.com")
+            for key, _, prompt, kind in CRED_FIELDS:
+                if creds[key]:
+                    continue
+                if kind == "secret":
+                    creds[key] = getpass.getpass(prompt)
+                else:
+                    creds[key] = validate_input(prompt, required=(kind == "required"))
+        if not all(creds[key] for key in REQUIRED_CREDS):
             print(f"{Colors.FAIL}Required TikTok credentials missing!{Colors.ENDC}")
             return
-        data["creds"] = creds
-        encrypt_data(data)
+        with mutate_data() as data:
+            data["creds"] = {**data.get("creds", {}), **{k: v for k, v in creds.items() if v is not None}}
         print(f"{Colors.OKGREEN}Credentials saved!{Colors.ENDC}")
     except Exception as e:
         print(f"{Colors.FAIL}Set credentials error: {e}{Colors.ENDC}")
@@ -397,6 +847,7 @@ class OAuthCallbackHandler(http.server.SimpleHTTPRequestHandler):
         if code and state:
             self.server.auth_code = code
             self.server.auth_state = state
+            self.server.done.set()
             self.send_response(200)
             self.send_header('Content-type', 'text/html')
             self.end_headers()
@@ -408,13 +859,15 @@ class OAuthCallbackHandler(http.server.SimpleHTTPRequestHandler):
 
 def start_local_server():
     """Start local HTTP server for OAuth callback."""
-    with socketserver.TCPServer(("", LOCAL_PORT), OAuthCallbackHandler) as httpd:
-        httpd.auth_code = None
-        httpd.auth_state = None
-        server_thread = threading.Thread(target=httpd.serve_forever)
-        server_thread.daemon = True
-        server_thread.start()
-        return httpd
+    httpd = http.server.ThreadingHTTPServer(("", LOCAL_PORT), OAuthCallbackHandler)
+    httpd.daemon_threads = True
+    httpd.auth_code = None
+    httpd.auth_state = None
+    httpd.done = threading.Event()  # Set by the handler once the callback arrives
+    server_thread = threading.Thread(target=httpd.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    return httpd
 
 def tiktok_oauth_login():
     """Perform OAuth login with local callback server."""
@@ -425,53 +878,61 @@ def tiktok_oauth_login():
         return
     if data.get("current_user"):
         username = data["current_user"]
-        user_data = get_user_data(username)
-        if refresh_token_if_needed(user_data):
+        user_data = data["users"].get(username, {})
+        if refresh_token_if_needed(user_data, creds):
             print(f"{Colors.OKGREEN}Token auto-refreshed for {username}!{Colors.ENDC}")
             return
     try:
         username = validate_input("Unique username: ")
         print(f"{Colors.OKBLUE}=== OAUTH LOGIN ==={Colors.ENDC}")
-        state = username  # Use username as state for verification
-        auth_url = f"{TIKTOK_OAUTH_BASE}/authorize/?client_key={creds['tiktok_app_id']}&scope=user.info.basic,video.list,ads.manage,research.data.basic,affiliate.seller&response_type=code&redirect_uri={REDIRECT_URI}&state={state}"
+        state = secrets.token_urlsafe(16)  # Unguessable, checked against the callback
+        code_verifier = secrets.token_urlsafe(48)  # PKCE: proves the token exchange comes from this login
+        code_challenge = hashlib.sha256(code_verifier.encode()).hexdigest()  # TikTok desktop flow expects hex
+        auth_url = OAUTH_AUTHORIZE_URL.format(client_key=creds['tiktok_app_id'], state=state, code_challenge=code_challenge)
+        httpd = start_local_server()  # Listen before the browser can redirect back
         print(f"{Colors.BOLD}Opening browser for authorization...{Colors.ENDC}")
         webbrowser.open(auth_url)
+        try:
+            if not httpd.done.wait(timeout=OAUTH_TIMEOUT):
+                print(f"{Colors.FAIL}Timed out waiting for the OAuth callback.{Colors.ENDC}")
+                return
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
         
-        httpd = start_local_server()
-        while not httpd.auth_code:
-            time.sleep(1)
-        
-        if httpd.auth_state != username:
+        if not hmac.compare_digest(httpd.auth_state, state):
             print(f"{Colors.FAIL}State mismatch in OAuth callback.{Colors.ENDC}")
             return
         
         auth_code = httpd.auth_code
-        httpd.shutdown()
         
-        loading_spinner("Exchanging code...")
         exchange_data = {
             "client_key": creds['tiktok_app_id'],
             "client_secret": creds['tiktok_app_secret'],
             "code": auth_code,
             "grant_type": "authorization_code",
-            "redirect_uri": REDIRECT_URI
+            "redirect_uri": REDIRECT_URI,
+            "code_verifier": code_verifier
         }
-        resp = requests.post(f"{TIKTOK_OAUTH_BASE}/token/", json=exchange_data)
-        resp.raise_for_status()
-        token_data = resp.json()
+        with loading_spinner("Exchanging code..."):
+            resp = session_post(f"{TIKTOK_OAUTH_BASE}/token/", json=exchange_data)
+            resp.raise_for_status()
+            token_data = response_json(resp)
         access_token = token_data.get("access_token")
         refresh_token = token_data.get("refresh_token")
         if access_token:
+            now = datetime.now()
             user_data = {
                 "tiktok_access_token": access_token,
                 "refresh_token": refresh_token,
-                "expires_at": (datetime.now() + timedelta(seconds=token_data.get("expires_in", 7200))).isoformat(),
+                "expires_at": (now + timedelta(seconds=token_data.get("expires_in", 7200))).isoformat(),
                 "tier": "enterprise",
-                "login_time": datetime.now().isoformat()
+                "login_time": now.isoformat()
             }
-            data["users"][username] = user_data
-            data["current_user"] = username
-            encrypt_data(data)
+            with mutate_data() as data:
+                data["users"][username] = user_data
+                data["current_user"] = username
+            _remember_token(user_data)
             print(f"{Colors.OKGREEN}Login successful! Welcome, {username}.{Colors.ENDC}")
     except requests.HTTPError as e:
         print(f"{Colors.FAIL}HTTP error in OAuth: {e}{Colors.ENDC}")
@@ -480,7 +941,34 @@ def tiktok_oauth_login():
     except Exception as e:
         print(f"{Colors.FAIL}OAuth error: {e}{Colors.ENDC}")
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+_TREND_CACHE = {"mtime": None, "entries": {}}  # Parsed trend cache file, keyed on its mtime
+
+def _load_trend_cache():
+    """Read cached hashtag rankings, dropping expired entries; the file is re-parsed only when it changes."""
+    try:
+        mtime = os.stat(TREND_CACHE_FILE).st_mtime_ns
+        if mtime != _TREND_CACHE["mtime"]:
+            with open(TREND_CACHE_FILE, 'rb') as f:
+                entries = _json_loads(f.read())
+            _TREND_CACHE.update(mtime=mtime, entries=entries if isinstance(entries, dict) else {})
+    except (OSError, ValueError):  # Missing, unreadable or corrupt: the cache is only an optimization
+        return {}
+    now = time.time()
+    return {key: entry for key, entry in _TREND_CACHE["entries"].items() if _trend_entry_fresh(entry, now)}
+
+def _trend_entry_fresh(entry, now):
+    """Whether a cache entry is well-formed and younger than TREND_CACHE_TTL; anything else counts as expired."""
+    ts = entry.get("ts") if isinstance(entry, dict) else None
+    return isinstance(ts, (int, float)) and "data" in entry and now - ts < TREND_CACHE_TTL
+
+def _save_trend_cache(cache):
+    """Atomically replace the trend cache file."""
+    tmp = TREND_CACHE_FILE + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(_json_dumps(cache))
+    os.replace(tmp, TREND_CACHE_FILE)
+    _TREND_CACHE.update(mtime=os.stat(TREND_CACHE_FILE).st_mtime_ns, entries=cache)
+
 def fetch_trending_hashtags(region="ID", start_date=None, end_date=None, limit=20):
     """Fetch trending hashtags using Research API."""
     data = load_data()
@@ -490,9 +978,14 @@ def fetch_trending_hashtags(region="ID", start_date=None, end_date=None, limit=2
         print(f"{Colors.FAIL}Research token required for trends.{Colors.ENDC}")
         return []
     if not start_date or not end_date:
-        end_date = datetime.now().strftime("%Y%m%d")
-        start_date = (datetime.now() - timedelta(days=29)).strftime("%Y%m%d")
-    headers = {"Authorization": f"Bearer {research_token}", "Content-Type": "application/json"}
+        now = datetime.now()
+        end_date = now.strftime("%Y%m%d")
+        start_date = (now - TREND_WINDOW).strftime("%Y%m%d")
+    cache_key = f"{region}|{start_date}|{end_date}|{limit}"
+    cache = _load_trend_cache()
+    if cache_key in cache:
+        return cache[cache_key]["data"]
+    headers = {"Authorization": f"Bearer {research_token}"}
     body = {
         "query": {"and": [{"operation": "IN", "field_name": "region_code", "field_values": [region]}]},
         "start_date": start_date,
@@ -501,16 +994,20 @@ def fetch_trending_hashtags(region="ID", start_date=None, end_date=None, limit=2
         "fields": "hashtag_names,view_count"
     }
     try:
-        resp = requests.post(TIKTOK_RESEARCH_BASE, headers=headers, json=body)
-        resp.raise_for_status()
-        videos = resp.json().get("data", {}).get("videos", [])
-        hashtags = {}
-        for video in videos:
-            for tag in video.get('hashtag_names', []):
-                if tag:
-                    hashtags[tag] = hashtags.get(tag, 0) + video.get('view_count', 0)
-        sorted_hashtags = sorted([{"name": k, "views": v} for k, v in hashtags.items()], key=lambda x: x["views"], reverse=True)[:limit]
-        return sorted_hashtags
+        videos = response_json(api_post(TIKTOK_RESEARCH_BASE, headers=headers, json=body)).get("data", {}).get("videos", [])
+        tags = pd.DataFrame(videos, columns=['hashtag_names', 'view_count']).explode('hashtag_names')
+        tags = tags[tags['hashtag_names'].notna() & (tags['hashtag_names'] != "")]
+        if tags.empty:
+            return []  # No videos, or none with hashtags; nlargest would fail on the object-dtype sum
+        views = tags['view_count'].fillna(0).astype(np.int64).groupby(tags['hashtag_names'], sort=False).sum().nlargest(limit)
+        hashtags = [{"name": k, "views": int(v)} for k, v in views.items()]
+        if hashtags:
+            cache[cache_key] = {"ts": time.time(), "data": hashtags}
+            try:
+                _save_trend_cache(cache)
+            except OSError:
+                pass  # The cache is only an optimization
+        return hashtags
     except requests.HTTPError as e:
         print(f"{Colors.FAIL}HTTP error fetching trends: {e}{Colors.ENDC}")
         return []
@@ -524,83 +1021,95 @@ def analyze_fyp_keyword(username):
     try:
         keyword = validate_input("Keyword (e.g., fashion indonesia): ")
         region = validate_input("Region (default ID): ", required=False) or "ID"
-        start_date = validate_input("Start date (YYYYMMDD): ", lambda x: len(x) == 8 and x.isdigit(), required=True)
-        end_date = validate_input("End date (YYYYMMDD, max 30 days): ", lambda x: len(x) == 8 and x.isdigit(), required=True)
-        loading_spinner("Fetching data via Research API...")
-        hashtags = fetch_trending_hashtags(region, start_date, end_date, 50)
+        start_date = validate_input("Start date (YYYYMMDD): ", DATE_RE.fullmatch, required=True)
+        end_date = validate_input("End date (YYYYMMDD, max 30 days): ", DATE_RE.fullmatch, required=True)
+        load_data()  # Decrypt (and migrate) the data file here once, not concurrently in both workers
+        with loading_spinner("Fetching data via Research API..."):
+            # Both queries are independent; the keyword pagination overlaps the trends call
+            with ThreadPoolExecutor(max_workers=2) as pool:
+                hashtags_future = pool.submit(fetch_trending_hashtags, region, start_date, end_date, 50)
+                videos_future = pool.submit(fetch_videos_by_keyword, keyword, region, start_date, end_date)
+                hashtags = hashtags_future.result()
+                df_videos, tag_names, tag_ids = videos_future.result()
         df_hashtags = pd.DataFrame(hashtags)
         if not df_hashtags.empty:
             top_hashtags = df_hashtags.nlargest(10, 'views')[['name', 'views']]
             print(f"{Colors.OKGREEN}Top Hashtags {region}:{Colors.ENDC}")
             print(top_hashtags.to_string(index=False))
             # Visualization
-            plt.bar(top_hashtags['name'], top_hashtags['views'])
-            plt.title(f'Top 10 Hashtags in {region}')
-            plt.xlabel('Hashtag')
-            plt.ylabel('Views')
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            plt.savefig(f'top_hashtags_{region}.png')
-            print(f"{Colors.OKGREEN}Saved hashtag visualization to 'top_hashtags_{region}.png'{Colors.ENDC}")
+            if EMIT_PLOTS:
+                with saved_chart(f'top_hashtags_{region}.png', f'Top 10 Hashtags in {region}', 'Hashtag', 'Views') as ax:
+                    ax.bar(top_hashtags['name'], top_hashtags['views'])
+                    ax.tick_params(axis='x', labelrotation=45)
+                print(f"{Colors.OKGREEN}Saved hashtag visualization to 'top_hashtags_{region}.png'{Colors.ENDC}")
         
-        video_data = fetch_videos_by_keyword(keyword, region, start_date, end_date)
-        df_videos = pd.DataFrame(video_data)
         if not df_videos.empty:
-            hourly_avg = df_videos.groupby('hour')['views'].mean()
-            peak_hour = hourly_avg.idxmax() if not hourly_avg.empty else "N/A"
+            # Pull the columns once; the hourly mean and the clustering both reuse them
+            hours = df_videos['hour'].to_numpy()
+            views = df_videos['views'].to_numpy(np.float64)
+            hour_counts = np.bincount(hours, minlength=24)
+            hour_sums = np.bincount(hours, weights=views, minlength=24)
+            posted = hour_counts > 0
+            hourly_avg = pd.Series(hour_sums[posted] / hour_counts[posted], index=np.flatnonzero(posted))
+            peak_hour = int(hourly_avg.idxmax()) if not hourly_avg.empty else "N/A"
             print(f"{Colors.OKGREEN}Peak FYP Hour {region}: {peak_hour}:00 (Avg Views: {hourly_avg.get(peak_hour, 0):,.0f}){Colors.ENDC}")
             # Visualization
-            plt.plot(hourly_avg.index, hourly_avg.values)
-            plt.title(f'Hourly Average Views for {keyword} in {region}')
-            plt.xlabel('Hour')
-            plt.ylabel('Average Views')
-            plt.savefig(f'hourly_views_{keyword}_{region}.png')
-            print(f"{Colors.OKGREEN}Saved hourly views visualization to 'hourly_views_{keyword}_{region}.png'{Colors.ENDC}")
+            if EMIT_PLOTS:
+                with saved_chart(f'hourly_views_{keyword}_{region}.png', f'Hourly Average Views for {keyword} in {region}', 'Hour', 'Average Views') as ax:
+                    ax.plot(hourly_avg.index, hourly_avg.values)
+                print(f"{Colors.OKGREEN}Saved hourly views visualization to 'hourly_views_{keyword}_{region}.png'{Colors.ENDC}")
             
-            all_tags = [tag for sublist in df_videos['hashtags'] for tag in sublist]
-            top_keywords = pd.Series(all_tags).value_counts().head(10)
+            # Tag occurrences counted over the interned IDs; stable sort keeps first-seen order on ties
+            tag_counts = np.bincount(tag_ids, minlength=len(tag_names))
+            top_ids = np.argsort(-tag_counts, kind='stable')[:10]
+            top_keywords = pd.Series({tag_names[i]: int(tag_counts[i]) for i in top_ids if tag_counts[i]}, dtype=np.int64)
             print(f"{Colors.BOLD}Top Keywords/Hashtags for '{keyword}':{Colors.ENDC}")
             print(top_keywords.to_string())
             
             if len(df_videos) > 10:
-                kmeans = KMeans(n_clusters=3, n_init=10)
-                clusters = kmeans.fit_predict(df_videos[['views', 'hour']])
+                # Standardize so views (millions) do not drown out hour (0-23)
+                features = np.column_stack((views, hours))
+                spread = features.std(axis=0)
+                features = (features - features.mean(axis=0)) / np.where(spread > 0, spread, 1)
+                kmeans = MiniBatchKMeans(n_clusters=3, n_init=3, batch_size=256, random_state=0)
+                clusters = kmeans.fit_predict(features)
                 df_videos['cluster'] = clusters
                 print(f"{Colors.OKGREEN}ML Clusters (High/Med/Low Engagement):{Colors.ENDC}")
-                print(df_videos.groupby('cluster')['views'].agg(['mean', 'count']).round(0))
+                cluster_counts = np.bincount(clusters, minlength=3)
+                cluster_means = np.bincount(clusters, weights=views, minlength=3) / np.maximum(cluster_counts, 1)
+                print(pd.DataFrame({'mean': cluster_means.round(0), 'count': cluster_counts}).rename_axis('cluster'))
                 # Visualization
-                plt.scatter(df_videos['hour'], df_videos['views'], c=df_videos['cluster'])
-                plt.title('Video Clusters by Hour and Views')
-                plt.xlabel('Hour')
-                plt.ylabel('Views')
-                plt.savefig(f'clusters_{keyword}_{region}.png')
-                print(f"{Colors.OKGREEN}Saved cluster visualization to 'clusters_{keyword}_{region}.png'{Colors.ENDC}")
+                if EMIT_PLOTS:
+                    with saved_chart(f'clusters_{keyword}_{region}.png', 'Video Clusters by Hour and Views', 'Hour', 'Views') as ax:
+                        ax.scatter(df_videos['hour'], df_videos['views'], c=df_videos['cluster'])
+                    print(f"{Colors.OKGREEN}Saved cluster visualization to 'clusters_{keyword}_{region}.png'{Colors.ENDC}")
             
             df_videos.to_csv(f"tiktok_analysis_{keyword}_{region}.csv", index=False)
             print(f"{Colors.OKGREEN}Exported to CSV!{Colors.ENDC}")
         
-        data = load_data()
-        data["analyses"].append({
+        append_analysis({
             "type": "fyp_analysis",
-            "date": datetime.now().isoformat(),
+            "date_ns": time.time_ns(),
             "summary": f"Analyzed '{keyword}' in {region}: {len(df_videos)} videos",
             "data": {"peak_hour": peak_hour, "top_keywords": top_keywords.to_dict() if 'top_keywords' in locals() else {}}
         })
-        encrypt_data(data)
     except requests.RequestException as e:
         print(f"{Colors.FAIL}API error in FYP analysis: {e}{Colors.ENDC}")
     except Exception as e:
         print(f"{Colors.FAIL}FYP analysis error: {e}{Colors.ENDC}")
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def _no_videos():
+    """Empty result in the shape returned by fetch_videos_by_keyword."""
+    return pd.DataFrame(), [], np.empty(0, dtype=np.int32)
+
 def fetch_videos_by_keyword(keyword, region, start_date, end_date, count=100):
-    """Fetch videos by keyword using Research API."""
+    """Fetch videos by keyword using Research API; returns (DataFrame of id/views/hour/hashtags, distinct tags, int32 tag index per occurrence)."""
     data = load_data()
     creds = data.get("creds", {})
     research_token = creds.get('research_access_token')
     if not research_token:
-        return []
-    headers = {"Authorization": f"Bearer {research_token}", "Content-Type": "application/json"}
+        return _no_videos()
+    headers = {"Authorization": f"Bearer {research_token}"}
     body = {
         "query": {"and": [
             {"operation": "EQ", "field_name": "keyword", "field_values": [keyword]},
@@ -612,91 +1121,101 @@ def fetch_videos_by_keyword(keyword, region, start_date, end_date, count=100):
         "fields": "id,view_count,create_time,hashtag_names"
     }
     try:
-        video_data = []
+        # Columns are filled in place as pages arrive, one slot per video
+        ids = np.empty(count, dtype=object)
+        views = np.zeros(count, dtype=np.int64)
+        create_times = np.zeros(count, dtype=np.int64)
+        hashtags = [None] * count
+        tag_to_id = {}  # Each distinct hashtag is numbered and its string stored once
+        tag_names = []
+        tag_ids = []
+        n = 0
         cursor = None
-        while len(video_data) < count:
+        while n < count:
             if cursor:
                 body["cursor"] = cursor
-            resp = requests.post(TIKTOK_RESEARCH_BASE, headers=headers, json=body)
-            resp.raise_for_status()
-            result = resp.json().get("data", {})
-            videos = result.get("videos", [])
-            for video in videos:
-                ts = datetime.fromtimestamp(video['create_time'])
-                video_data.append({
-                    'id': video['id'],
-                    'views': video.get('view_count', 0),
-                    'hour': ts.hour,
-                    'hashtags': video.get('hashtag_names', [])
-                })
+            result = response_json(api_post(TIKTOK_RESEARCH_BASE, headers=headers, json=body)).get("data", {})
+            for video in result.get("videos", [])[:count - n]:
+                ids[n] = video['id']
+                views[n] = video.get('view_count') or 0  # The API may send null
+                create_times[n] = video['create_time']
+                row_tags = []
+                for tag in video.get('hashtag_names', []):
+                    tag_id = tag_to_id.get(tag)
+                    if tag_id is None:
+                        tag_id = tag_to_id[tag] = len(tag_names)
+                        tag_names.append(tag)
+                    tag_ids.append(tag_id)
+                    row_tags.append(tag_names[tag_id])  # Rows share one string object per tag
+                hashtags[n] = row_tags
+                n += 1
             cursor = result.get("cursor")
             if not result.get("has_more") or not cursor:
                 break
-        return video_data[:count]
+        # Local posting hour per video, so each timestamp gets the UTC offset (DST) in force when it was posted
+        hours = np.fromiter((time.localtime(ts).tm_hour for ts in create_times[:n].tolist()), dtype=np.int64, count=n)
+        df = pd.DataFrame({'id': ids[:n], 'views': views[:n], 'hour': hours, 'hashtags': hashtags[:n]})
+        return df, tag_names, np.array(tag_ids, dtype=np.int32)
     except requests.HTTPError as e:
         print(f"{Colors.FAIL}HTTP error fetching videos: {e}{Colors.ENDC}")
-        return []
+        return _no_videos()
     except requests.RequestException as e:
         print(f"{Colors.FAIL}Request error fetching videos: {e}{Colors.ENDC}")
-        return []
+        return _no_videos()
 
 def promosi_menu(username):
     """Promote via real TikTok Ads."""
     print(f"{Colors.OKBLUE}=== REAL TIKTOK ADS PROMOTION ==={Colors.ENDC}")
     try:
-        user_data = get_user_data(username)
-        if not refresh_token_if_needed(user_data):
-            return
         data = load_data()
         creds = data.get("creds", {})
         advertiser_id = creds.get('tiktok_advertiser_id')
         if not advertiser_id:
             print(f"{Colors.FAIL}Advertiser ID required.{Colors.ENDC}")
             return
-        headers = {
-            "Access-Token": user_data['tiktok_access_token'],
-            "Content-Type": "application/json"
-        }
-        target = validate_input("1. Target (TRAFFIC/ENGAGEMENT/FOLLOWERS): ", lambda x: x.upper() in ['TRAFFIC', 'ENGAGEMENT', 'FOLLOWERS'])
-        video_url = validate_input("2. Video URL: ", lambda x: 'tiktok.com' in x)
-        budget = int(validate_input("3. Budget (Rp, min 1790): ", lambda x: x.isdigit() and int(x) >= MIN_BUDGET))
-        loading_spinner("Creating real campaign...")
-        campaign_data = {
-            "advertiser_id": advertiser_id,
-            "campaign_name": f"Promo_{username}_{datetime.now().strftime('%Y%m%d')}",
-            "budget": budget,
-            "objective_type": target,
-            "status": "ENABLE"
-        }
-        resp = requests.post(f"{TIKTOK_API_BASE}/campaign/create/", json=campaign_data, headers=headers)
-        resp.raise_for_status()
-        campaign = resp.json().get("data", {})
-        campaign_id = campaign.get("campaign_id")
-        ad_group_data = {
-            "advertiser_id": advertiser_id,
-            "campaign_id": campaign_id,
-            "adgroup_name": "AdGroup1",
-            "budget": budget,
-            "objective_type": target
-        }
-        ag_resp = requests.post(f"{TIKTOK_API_BASE}/adgroup/create/", json=ad_group_data, headers=headers)
-        ag_resp.raise_for_status()
-        ad_group_id = ag_resp.json().get("data", {}).get("adgroup_id")
-        ad_data = {
-            "advertiser_id": advertiser_id,
-            "adgroup_id": ad_group_id,
-            "ad_name": "Ad1",
-            "creative": {"video_id": video_url.split('/')[-1].split('?')[0]}
-        }
-        ad_resp = requests.post(f"{TIKTOK_API_BASE}/ad/create/", json=ad_data, headers=headers)
-        ad_resp.raise_for_status()
-        data["analyses"].append({
+        user_data = data["users"].get(username, {})
+        if not refresh_token_if_needed(user_data, creds):
+            return
+        headers = {"Access-Token": user_data['tiktok_access_token']}
+        target = validate_input("1. Target (TRAFFIC/ENGAGEMENT/FOLLOWERS): ", lambda x: x.upper() in AD_OBJECTIVES).upper()
+        video_url = validate_input("2. Video URL: ", lambda x: tiktok_video_id(x) is not None)
+        budget = int(validate_input("3. Budget (Rp, min 1790): ", lambda x: DIGITS_RE.fullmatch(x) and int(x) >= MIN_BUDGET))
+        with loading_spinner("Creating real campaign..."):
+            campaign_data = {
+                "advertiser_id": advertiser_id,
+                "campaign_name": f"Promo_{username}_{datetime.now().strftime('%Y%m%d')}",
+                "budget": budget,
+                "objective_type": target,
+                "status": "ENABLE"
+            }
+            resp = session_post(f"{TIKTOK_API_BASE}/campaign/create/", json=campaign_data, headers=headers)
+            resp.raise_for_status()
+            campaign = response_json(resp).get("data", {})
+            campaign_id = campaign.get("campaign_id")
+            ad_group_data = {
+                "advertiser_id": advertiser_id,
+                "campaign_id": campaign_id,
+                "adgroup_name": "AdGroup1",
+                "budget": budget,
+                "objective_type": target
+            }
+            ag_resp = session_post(f"{TIKTOK_API_BASE}/adgroup/create/", json=ad_group_data, headers=headers)
+            ag_resp.raise_for_status()
+            ad_group_id = response_json(ag_resp).get("data", {}).get("adgroup_id")
+            ad_data = {
+                "advertiser_id": advertiser_id,
+                "adgroup_id": ad_group_id,
+                "ad_name": "Ad1",
+                "creative": {"video_id": tiktok_video_id(video_url)}
+            }
+            ad_resp = session_post(f"{TIKTOK_API_BASE}/ad/create/", json=ad_data, headers=headers)
+            ad_resp.raise_for_status()
+        append_analysis({
             "type": "promotion",
-            "date": datetime.now().isoformat(),
+            "date_ns": time.time_ns(),
             "summary": f"Campaign {campaign_id} created: {budget} Rp",
             "data": {"campaign_id": campaign_id, "adgroup_id": ad_group_id}
         })
-        encrypt_data(data)
         print(f"{Colors.OKGREEN}Campaign live! ID: {campaign_id}. Monitor in Ads Manager.{Colors.ENDC}")
     except requests.HTTPError as e:
         print(f"{Colors.FAIL}HTTP error in Ads API: {e}{Colors.ENDC}")
@@ -705,128 +1224,246 @@ def promosi_menu(username):
     except ValueError as e:
         print(f"{Colors.FAIL}Input error: {e}{Colors.ENDC}")
 
+@functools.lru_cache(maxsize=4)
+def _shop_signer(shop_secret):
+    """Keyed HMAC-SHA256 state for a Shop secret; copy it for each signature."""
+    return hmac.new(shop_secret.encode(), digestmod=hashlib.sha256)
+
+def fetch_orders(product_id, headers):
+    """All order/query pages for a product; pages after the first are fetched concurrently."""
+    url = f"{TIKTOK_SHOP_AFFILIATE_BASE}/order/query/"
+
+    def page(cursor):
+        params = {"product_id": product_id, "cursor": cursor, "limit": ORDER_PAGE_SIZE}
+        return response_json(api_get(url, params=params, headers=headers)).get("data", {})
+
+    first = page(0)
+    orders = first.get("orders", [])
+    if len(orders) < ORDER_PAGE_SIZE:  # A short first page is the only page
+        return orders
+    total = int(first.get("total") or 0)
+    if total > MAX_ORDER_PAGES * ORDER_PAGE_SIZE:
+        print(f"{Colors.WARNING}Only the first {MAX_ORDER_PAGES * ORDER_PAGE_SIZE:,} of {total:,} orders are counted.{Colors.ENDC}")
+    cursors = range(ORDER_PAGE_SIZE, min(total, MAX_ORDER_PAGES * ORDER_PAGE_SIZE), ORDER_PAGE_SIZE)
+    if not cursors:
+        return orders
+    with ThreadPoolExecutor(max_workers=min(len(cursors), 4)) as pool:
+        rest = [p.get("orders", []) for p in pool.map(page, cursors)]
+    return list(itertools.chain(orders, *rest))
+
+@api_errors("in Affiliate API")
 def affiliate_booster(username):
     """Boost affiliate performance."""
     print(f"{Colors.OKBLUE}=== AFFILIATE BOOSTER ==={Colors.ENDC}")
+    data = load_data()
+    creds = data.get("creds", {})
+    shop_app_id = creds.get('shop_app_id')
+    shop_secret = creds.get('shop_secret')
+    if not shop_app_id or not shop_secret:
+        print(f"{Colors.FAIL}Shop credentials required.{Colors.ENDC}")
+        return
+    product_id = validate_input("Product ID: ", DIGITS_RE.fullmatch)
+    timestamp = str(int(time.time()))  # Taken after the prompt so the signature is fresh
+    signer = _shop_signer(shop_secret).copy()
+    signer.update(f"{shop_app_id}{timestamp}".encode())
+    headers = {
+        "Authorization": f"Sign {signer.hexdigest()}",
+        "x-tts-app-id": shop_app_id,
+        "Timestamp": timestamp
+    }
+    promo_data = {"product_id": product_id, "commission_rate": 10}
+    now = datetime.now()
+    start_date = (now - TREND_WINDOW).strftime("%Y%m%d")
+    end_date = now.strftime("%Y%m%d")
+    # Trend suggestions overlap link creation; orders are only paged through once the link exists
+    pool = ThreadPoolExecutor(max_workers=3)
     try:
-        data = load_data()
-        creds = data.get("creds", {})
-        shop_app_id = creds.get('shop_app_id')
-        shop_secret = creds.get('shop_secret')
-        if not shop_app_id or not shop_secret:
-            print(f"{Colors.FAIL}Shop credentials required.{Colors.ENDC}")
-            return
-        timestamp = str(int(time.time()))
-        signature = hmac.new(shop_secret.encode(), f"{shop_app_id}{timestamp}".encode(), hashlib.sha256).hexdigest()
-        headers = {
-            "Authorization": f"Sign {signature}",
-            "x-tts-app-id": shop_app_id,
-            "Timestamp": timestamp,
-            "Content-Type": "application/json"
-        }
-        product_id = validate_input("Product ID: ", lambda x: x.isdigit())
-        loading_spinner("Generating affiliate link...")
-        promo_data = {"product_id": product_id, "commission_rate": 10}
-        resp = requests.post(f"{TIKTOK_SHOP_AFFILIATE_BASE}/promotion/link/create/", json=promo_data, headers=headers)
-        resp.raise_for_status()
-        promo_link = resp.json().get("data", {}).get("promotion_url")
+        link_future = pool.submit(session_post, f"{TIKTOK_SHOP_AFFILIATE_BASE}/promotion/link/create/", json=promo_data, headers=headers)
+        trends_future = pool.submit(fetch_trending_hashtags, "ID", start_date, end_date, 5)
+        with loading_spinner("Generating affiliate link..."):
+            resp = link_future.result()
+            resp.raise_for_status()
+        orders_future = pool.submit(fetch_orders, product_id, headers)
+        promo_link = response_json(resp).get("data", {}).get("promotion_url")
         print(f"{Colors.OKGREEN}Affiliate Link: {promo_link}{Colors.ENDC}")
-        start_date = (datetime.now() - timedelta(days=29)).strftime("%Y%m%d")
-        end_date = datetime.now().strftime("%Y%m%d")
-        trends = fetch_trending_hashtags("ID", start_date, end_date, 5)
+        trends = trends_future.result()
         print(f"{Colors.BOLD}Suggested Creators/Hashtags: {', '.join([t['name'] for t in trends])}{Colors.ENDC}")
-        track_resp = requests.get(f"{TIKTOK_SHOP_AFFILIATE_BASE}/order/query/?product_id={product_id}&limit=10", headers=headers)
-        track_resp.raise_for_status()
-        orders = track_resp.json().get("data", {}).get("orders", [])
-        total_commission = sum(o.get("commission", 0) for o in orders)
-        print(f"{Colors.OKGREEN}Current Commissions: Rp {total_commission:,}{Colors.ENDC}")
-    except requests.HTTPError as e:
-        print(f"{Colors.FAIL}HTTP error in Affiliate API: {e}{Colors.ENDC}")
-    except requests.RequestException as e:
-        print(f"{Colors.FAIL}Request error in Affiliate API: {e}{Colors.ENDC}")
+        orders = orders_future.result()
+    finally:
+        pool.shutdown(cancel_futures=True)  # A running trends call is bounded by REQUEST_TIMEOUT; let its output finish first
+    total_commission = sum(o.get("commission", 0) for o in orders)
+    print(f"{Colors.OKGREEN}Current Commissions: Rp {total_commission:,}{Colors.ENDC}")
 
 def logout(username):
     """Logout user."""
     try:
-        data = load_data()
-        if username in data["users"]:
-            del data["users"][username]
-        data["current_user"] = None
-        encrypt_data(data)
+        with mutate_data() as data:
+            if username in data["users"]:
+                del data["users"][username]
+            data["current_user"] = None
+        _TOKEN_CACHE["token"] = None
         print(f"{Colors.OKGREEN}Logged out.{Colors.ENDC}")
     except Exception as e:
         print(f"{Colors.FAIL}Logout error: {e}{Colors.ENDC}")
 
+# Menu choice -> (requires login, handler taking the current user)
+MENU_ACTIONS = {
+    '1': (False, lambda user: tiktok_oauth_login()),
+    '2': (True, show_dashboard),
+    '3': (True, generate_content),
+    '4': (True, analyze_video),
+    '5': (True, performance_tracking),
+    '6': (True, account_management),
+    '7': (True, logout),
+    '8': (True, promosi_menu),
+    '9': (False, lambda user: set_credentials()),
+    '10': (True, analyze_fyp_keyword),
+    '11': (True, affiliate_booster),
+    '12': (False, lambda user: run_tests()),
+}
+
 def main_menu():
     """Main menu loop."""
+    current_user = load_data().get("current_user")
     while True:
-        print_header()
-        print_menu_border("ADVANCED MENU v2.2")
-        print(f"{Colors.OKBLUE}1. Login TikTok OAuth (Required First){Colors.ENDC}")
-        print(f"{Colors.OKBLUE}2. Dashboard{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}3. Generate Content (Trend-Based){Colors.ENDC}")
-        print(f"{Colors.OKBLUE}4. Analyze Video{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}5. Performance Tracking{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}6. Account Management{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}7. Logout{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}8. Promote TikTok Ads{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}9. Set Credentials{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}10. Analyze FYP/Keywords/Hashtags{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}11. Affiliate Booster{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}12. Run Unit Tests{Colors.ENDC}")
-        print(f"{Colors.OKBLUE}0. Exit{Colors.ENDC}")
-        print(BORDER_END)
+        write_bytes(MAIN_MENU_BYTES)
         choice = input(f"{Colors.WARNING}Choose: {Colors.ENDC}").strip()
-        data = load_data()
-        current_user = data.get("current_user")
-        if not current_user and choice not in ['1', '9', '0', '12']:
-            print(f"{Colors.FAIL}Login first with 1!{Colors.ENDC}")
-            input("Press Enter...")
-            continue
-        if choice == '1':
-            tiktok_oauth_login()
-        elif choice == '2':
-            show_dashboard(current_user)
-        elif choice == '3':
-            generate_content(current_user)
-        elif choice == '4':
-            analyze_video(current_user)
-        elif choice == '5':
-            performance_tracking(current_user)
-        elif choice == '6':
-            account_management(current_user)
-        elif choice == '7':
-            logout(current_user)
-        elif choice == '8':
-            promosi_menu(current_user)
-        elif choice == '9':
-            set_credentials()
-        elif choice == '10':
-            analyze_fyp_keyword(current_user)
-        elif choice == '11':
-            affiliate_booster(current_user)
-        elif choice == '12':
-            unittest.main(argv=[''], exit=False)
-        elif choice == '0':
+        if choice == '0':
             print(f"{Colors.OKGREEN}Bye!{Colors.ENDC}")
             break
-        else:
+        action = MENU_ACTIONS.get(choice)
+        if action is None:
             print(f"{Colors.FAIL}Invalid choice!{Colors.ENDC}")
+        else:
+            needs_login, handler = action
+            if needs_login and not current_user:
+                print(f"{Colors.FAIL}Login first with 1!{Colors.ENDC}")
+                input("Press Enter...")
+                continue
+            handler(current_user)
+        if choice in ['1', '6', '7']:  # Login state may have changed
+            current_user = load_data().get("current_user")
         input("\nPress Enter to continue...")
 
-class TestTikTokKit(unittest.TestCase):
-    """Unit tests for TikTok Kit functions."""
-    def test_validate_input(self):
-        """Test input validation."""
-        with self.subTest("Valid date"):
-            self.assertEqual(validate_input("20250101", lambda x: len(x) == 8 and x.isdigit(), True), "20250101")
-        with self.subTest("Invalid date"):
-            try:
-                validate_input("invalid", lambda x: len(x) == 8 and x.isdigit(), True)
-            except SystemExit:  # Since it loops, but for test assume it fails
-                pass
+def run_tests():
+    """Run the built-in unit tests."""
+    import unittest  # Only needed here; keeps it off the startup path
+    unittest.TextTestRunner().run(unittest.defaultTestLoader.loadTestsFromTestCase(_get_tests()))
+
+def _get_tests():
+    """Build the unit test case on demand so unittest is only imported for menu option 12."""
+    import tempfile
+    import unittest
+    from unittest import mock
+
+    class TestTikTokKit(unittest.TestCase):
+        """Unit tests for TikTok Kit functions."""
+        def isolate_files(self):
+            """Point the data, key and analyses files at a temporary directory for this test."""
+            tmp = tempfile.TemporaryDirectory()
+            self.addCleanup(tmp.cleanup)
+            module = sys.modules[__name__]
+            for name in ("DATA_FILE", "KEY_FILE", "ANALYSES_FILE"):
+                patcher = mock.patch.object(module, name, os.path.join(tmp.name, name.lower()))
+                patcher.start()
+                self.addCleanup(patcher.stop)
+            for patcher in (mock.patch.dict(_LOG_SIZE, end=None), mock.patch.dict(_CACHE, data=None, mtime=None, payload=None)):
+                patcher.start()
+                self.addCleanup(patcher.stop)
+            _get_cipher.cache_clear()
+            self.addCleanup(_get_cipher.cache_clear)
+
+        def test_validate_input(self):
+            """Test input validation."""
+            with self.subTest("Valid date"):
+                self.assertEqual(validate_input("20250101", lambda x: len(x) == 8 and x.isdigit(), True), "20250101")
+            with self.subTest("Invalid date"):
+                try:
+                    validate_input("invalid", lambda x: len(x) == 8 and x.isdigit(), True)
+                except SystemExit:  # Since it loops, but for test assume it fails
+                    pass
+
+        def test_tiktok_video_id(self):
+            """Test video ID extraction from TikTok URLs."""
+            self.assertEqual(tiktok_video_id("https://www.tiktok.com/@user/video/7234567890123456789?lang=en"), "7234567890123456789")
+            self.assertEqual(tiktok_video_id("tiktok.com/@user/video/123/"), "123")
+            self.assertIsNone(tiktok_video_id("https://nottiktok.com.evil/video/123"))
+            self.assertIsNone(tiktok_video_id("https://www.tiktok.com/@user"))
+
+        def test_trending_hashtags_empty_response(self):
+            """Test that trend lookups without hashtagged videos return no hashtags."""
+            module = sys.modules[__name__]
+            resp = mock.Mock(content=b'{"data": {"videos": []}}')
+            with mock.patch.object(module, "load_data", return_value={"creds": {"research_access_token": "token"}}), \
+                    mock.patch.object(module, "_load_trend_cache", return_value={}), \
+                    mock.patch.object(module, "api_post", return_value=resp):
+                self.assertEqual(fetch_trending_hashtags("ID", "20250101", "20250110", 5), [])
+                resp.content = b'{"data": {"videos": [{"view_count": 10}, {"hashtag_names": [], "view_count": null}]}}'
+                self.assertEqual(fetch_trending_hashtags("ID", "20250101", "20250110", 5), [])
+
+        def test_append_after_torn_frame(self):
+            """Test that frames appended after an interrupted write stay readable."""
+            self.isolate_files()
+            _append_frames([{"n": 0}, {"n": 1}])
+            with open(ANALYSES_FILE, 'ab') as f:
+                f.write((100).to_bytes(4, 'big') + b"partial")
+            for n in range(2, 5):
+                _append_frames([{"n": n}])
+            self.assertEqual([entry["n"] for entry in read_analyses()], [0, 1, 2, 3, 4])
+
+        def test_compact_analyses_with_torn_frame(self):
+            """Test that compaction keeps the newest complete entries and drops a torn tail."""
+            self.isolate_files()
+            for n in range(4):
+                _append_frames([{"n": n}])
+            with open(ANALYSES_FILE, 'ab') as f:
+                f.write((100).to_bytes(4, 'big') + b"partial")
+            _append_frames([{"n": 4}, {"n": 5}])
+            with open(ANALYSES_FILE, 'ab') as f:
+                f.write(b"\x00\x00")
+            with mock.patch.object(sys.modules[__name__], "MAX_ANALYSES", 3):
+                _compact_analyses()
+            self.assertEqual([entry["n"] for entry in read_analyses()], [3, 4, 5])
+            _append_frames([{"n": 6}])
+            self.assertEqual([entry["n"] for entry in read_analyses()], [3, 4, 5, 6])
+
+        def test_cipher_round_trip(self):
+            """Test AES-GCM encryption round-trips, also through a freshly loaded key."""
+            self.isolate_files()
+            blob = _get_cipher().encrypt(b"payload")
+            self.assertEqual(_get_cipher().decrypt(blob), b"payload")
+            _get_cipher.cache_clear()
+            self.assertEqual(_get_cipher().decrypt(blob), b"payload")
+
+        def test_cipher_reads_legacy_fernet(self):
+            """Test that Fernet tokens written before the AES-GCM switch still decrypt."""
+            from cryptography.fernet import Fernet
+            self.isolate_files()
+            key = Fernet.generate_key()
+            with open(KEY_FILE, 'wb') as f:
+                f.write(key)
+            self.assertEqual(_get_cipher().decrypt(Fernet(key).encrypt(b"legacy")), b"legacy")
+
+        def test_cipher_reads_data_from_before_rotation(self):
+            """Test that data saved under a rotated-out key still loads."""
+            self.isolate_files()
+            data = {"users": {}, "creds": {"x": 1}, "current_user": None, "analysis_counts": {}, "recent_analyses": []}
+            encrypt_data(data)
+            flush_data()
+            _append_frames([{"n": 0}])
+            old = time.time() - 31 * 24 * 3600
+            os.utime(KEY_FILE, (old, old))
+            _get_cipher.cache_clear()
+            with mock.patch("builtins.print"):
+                self.assertEqual(load_data_fresh(), data)
+            with open(KEY_FILE, 'rb') as f:
+                self.assertEqual(len(f.read().split()), 2)
+            _append_frames([{"n": 1}])
+            self.assertEqual([entry["n"] for entry in read_analyses()], [0, 1])
+
+        # Add more tests, e.g., mock API calls with unittest.mock
 
-    # Add more tests, e.g., mock API calls with unittest.mock
+    return TestTikTokKit
 
 if __name__ == "__main__":
     main_menu()
\ No newline at end of file